@@ -1,8 +1,10 @@
+import hashlib
 import logging
 import tarfile
 import zipfile
+from functools import partial
 from pathlib import Path
-from typing import Generator, Optional, Union
+from typing import Generator, Iterable, Iterator, Optional, Union
 import datetime
 
 import rarfile
@@ -40,24 +42,41 @@ SUPPORTED_ARCHIVE_FORMATS = {
 }
 
 
+# 流式读取压缩包条目时每次读取的字节数
+ARCHIVE_READ_CHUNK_SIZE = 64 * 1024
+
+# 多段扩展名（如 .tar.gz）需要 endswith 判断，其余格式按最后一段扩展名查表
+_MULTI_PART_EXTENSIONS = tuple(
+    ext for ext in SUPPORTED_ARCHIVE_FORMATS if ext.count(".") > 1
+)
+# 只需对文件名末尾这么多字符转小写即可判断所有支持的扩展名
+_MAX_EXTENSION_LENGTH = max(len(ext) for ext in SUPPORTED_ARCHIVE_FORMATS)
+
+
+def _match_archive_extension(file_path: Union[str, Path]) -> Optional[str]:
+    """返回文件名匹配的压缩包扩展名，不匹配时返回 None"""
+    name = Path(file_path).name[-_MAX_EXTENSION_LENGTH:].lower()
+
+    if name.endswith(_MULTI_PART_EXTENSIONS):
+        for ext in _MULTI_PART_EXTENSIONS:
+            if name.endswith(ext):
+                return ext
+
+    dot = name.rfind(".")
+    if dot == -1:
+        return None
+    ext = name[dot:]
+    return ext if ext in SUPPORTED_ARCHIVE_FORMATS else None
+
+
 def is_archive_file(file_path: Union[str, Path]) -> bool:
     """检查文件是否为支持的压缩包格式"""
-    file_path = Path(file_path)
-
-    for ext in SUPPORTED_ARCHIVE_FORMATS:
-        if file_path.name.lower().endswith(ext):
-            return True
-    return False
+    return _match_archive_extension(file_path) is not None
 
 
 def get_archive_type(file_path: Union[str, Path]) -> Optional[str]:
     """获取压缩包类型"""
-    file_path = Path(file_path)
-
-    for ext, archive_type in SUPPORTED_ARCHIVE_FORMATS.items():
-        if file_path.name.lower().endswith(ext):
-            return archive_type
-    return None
+    return SUPPORTED_ARCHIVE_FORMATS.get(_match_archive_extension(file_path))
 
 
 class ArchiveEntry:
@@ -70,19 +89,40 @@ class ArchiveEntry:
         modified: datetime.datetime,
         is_dir: bool = False,
         data_reader: Optional[callable] = None,
+        stream_opener: Optional[callable] = None,
+        data: Optional[bytes] = None,
     ):
         self.name = name
         self.size = size
         self.modified = modified
         self.is_dir = is_dir
         self.data_reader = data_reader
+        self.stream_opener = stream_opener
+        # 已读入内存的数据直接保存，无需再包一层闭包
+        self.data = data
 
     def read_data(self) -> bytes:
         """读取文件数据"""
+        if self.data is not None:
+            return self.data
         if self.data_reader:
             return self.data_reader()
+        if self.stream_opener:
+            return b"".join(self.iter_chunks())
         return b""
 
+    def iter_chunks(self, chunk_size: int = ARCHIVE_READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """按块读取文件数据，避免整个条目驻留内存"""
+        if not self.stream_opener:
+            data = self.read_data()
+            if data:
+                yield data
+            return
+
+        with self.stream_opener() as stream:
+            while chunk := stream.read(chunk_size):
+                yield chunk
+
 
 class ArchiveScanner:
     """压缩包扫描器基类"""
@@ -92,14 +132,25 @@ class ArchiveScanner:
     ):
         self.archive_path = Path(archive_path)
         self.max_file_size = max_file_size or 100 * 1024 * 1024  # 100MB
+        # 每个条目都会用到的压缩包路径字符串，构造时计算一次
+        self._archive_posix_path = self.archive_path.as_posix()
+        self._archive_absolute_path = str(self.archive_path.absolute())
+        # 按需读取条目数据的扫描器在此保存打开的压缩包
+        self._archive = None
 
     def scan_entries(self) -> Generator[ArchiveEntry, None, None]:
         """扫描压缩包内的文件条目"""
         raise NotImplementedError
 
+    def close(self) -> None:
+        """关闭扫描时保持打开的压缩包，之后条目数据不可再读取"""
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
     def create_virtual_path(self, internal_path: str) -> str:
         """创建虚拟路径格式：archive_path::internal_path"""
-        return f"{self.archive_path.as_posix()}::{internal_path}"
+        return f"{self._archive_posix_path}::{internal_path}"
 
     def create_file_meta(
         self, entry: ArchiveEntry, machine: str, scanned: datetime.datetime
@@ -115,7 +166,7 @@ class ArchiveScanner:
             modified=entry.modified,
             scanned=scanned,
             is_archived=1,
-            archive_path=str(self.archive_path.absolute()),
+            archive_path=self._archive_absolute_path,
         )
         return meta
 
@@ -164,80 +215,58 @@ class ZipArchiveScanner(ArchiveScanner):
         fails = 0
         threshold = getattr(cached_config, "archive_entry_fail_threshold", 50)
         try:
-            with zipfile.ZipFile(self.archive_path, "r") as zip_file:
+            self.close()
+            zip_file = zipfile.ZipFile(self.archive_path, "r")
+            # 条目数据按需流式读取，压缩包保持打开直到调用 close()
+            self._archive = zip_file
+            try:
+                entries = zip_file.infolist()
+            except Exception as e:
+                logger.error(f"Error listing entries in ZIP {self.archive_path}: {e}")
+                metrics.inc_errors("archive_list")
+                return
+            for info in entries:
                 try:
-                    entries = zip_file.infolist()
-                except Exception as e:
-                    logger.error(
-                        f"Error listing entries in ZIP {self.archive_path}: {e}"
-                    )
-                    metrics.inc_errors("archive_list")
-                    return
-                for info in entries:
-                    try:
-                        # 解码文件名
-                        decoded_filename = self._decode_filename(info)
+                    # 解码文件名
+                    decoded_filename = self._decode_filename(info)
 
-                        # 跳过目录
-                        if info.is_dir():
-                            continue
-
-                        # 跳过过大的文件
-                        if info.file_size > self.max_file_size:
-                            logger.warning(
-                                f"Skipping large file in ZIP: {decoded_filename} ({info.file_size} bytes)"
-                            )
-                            continue
-
-                        # 获取修改时间
-                        try:
-                            modified = datetime.datetime(*info.date_time)
-                        except (ValueError, TypeError):
-                            modified = datetime.datetime.now()
-
-                        # 提前读取数据（注意：会占用内存，但必须在 zip_file 打开时读取）
-                        try:
-                            data = zip_file.read(info.filename)
-
-                            def make_reader(file_data):
-                                return lambda: file_data
+                    # 跳过目录
+                    if info.is_dir():
+                        continue
 
-                            entry = ArchiveEntry(
-                                name=decoded_filename,
-                                size=info.file_size,
-                                modified=modified,
-                                data_reader=make_reader(data),
-                            )
-                            yield entry
-                        except (
-                            zipfile.BadZipFile,
-                            zipfile.LargeZipFile,
-                            Exception,
-                        ) as e:
-                            logger.warning(
-                                f"Error reading file {decoded_filename} from ZIP: {e}"
-                            )
-                            metrics.inc_errors("archive_entry_read")
-                            fails += 1
-                            if fails >= threshold:
-                                logger.warning(
-                                    f"Too many entry read failures in ZIP, skipping archive: {self.archive_path}"
-                                )
-                                break
-                            continue
-                    except Exception as e:
-                        # 捕获处理单个条目时的任何未预期异常
+                    # 跳过过大的文件
+                    if info.file_size > self.max_file_size:
                         logger.warning(
-                            f"Unexpected error processing entry in ZIP {self.archive_path}: {e}",
-                            exc_info=True,
+                            f"Skipping large file in ZIP: {decoded_filename} ({info.file_size} bytes)"
                         )
-                        fails += 1
-                        if fails >= threshold:
-                            logger.warning(
-                                f"Too many failures in ZIP, skipping archive: {self.archive_path}"
-                            )
-                            break
                         continue
+
+                    # 获取修改时间
+                    try:
+                        modified = datetime.datetime(*info.date_time)
+                    except (ValueError, TypeError):
+                        modified = datetime.datetime.now()
+
+                    # 不提前读取数据：调用方在 close() 之前按需流式读取
+                    yield ArchiveEntry(
+                        name=decoded_filename,
+                        size=info.file_size,
+                        modified=modified,
+                        stream_opener=partial(zip_file.open, info),
+                    )
+                except Exception as e:
+                    # 捕获处理单个条目时的任何未预期异常
+                    logger.warning(
+                        f"Unexpected error processing entry in ZIP {self.archive_path}: {e}",
+                        exc_info=True,
+                    )
+                    fails += 1
+                    if fails >= threshold:
+                        logger.warning(
+                            f"Too many failures in ZIP, skipping archive: {self.archive_path}"
+                        )
+                        break
+                    continue
         except (zipfile.BadZipFile, Exception) as e:
             logger.error(
                 f"Error scanning ZIP file {self.archive_path}: {e}", exc_info=True
@@ -251,17 +280,28 @@ class TarArchiveScanner(ArchiveScanner):
     def scan_entries(self) -> Generator[ArchiveEntry, None, None]:
         fails = 0
         threshold = getattr(cached_config, "archive_entry_fail_threshold", 50)
+        # 压缩的 TAR 只能顺序解压，用流模式（r|*）省去随机访问的回退开销；
+        # 未压缩的 TAR 保留随机访问模式，以便直接跳过被忽略成员的数据
+        if _match_archive_extension(self.archive_path) == ".tar":
+            mode = "r:*"
+        else:
+            mode = "r|*"
         try:
-            with tarfile.open(self.archive_path, "r:*") as tar_file:
-                try:
-                    members = tar_file.getmembers()
-                except Exception as e:
-                    logger.error(
-                        f"Error listing entries in TAR {self.archive_path}: {e}"
-                    )
-                    metrics.inc_errors("archive_list")
-                    return
-                for member in members:
+            with tarfile.open(self.archive_path, mode) as tar_file:
+                # 边读取成员头边处理，不用 getmembers() 预先遍历整个压缩包：
+                # 对 .tar.gz 等压缩格式，预先遍历后再回头读取数据需要重新解压
+                members = iter(tar_file)
+                while True:
+                    try:
+                        member = next(members)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        logger.error(
+                            f"Error listing entries in TAR {self.archive_path}: {e}"
+                        )
+                        metrics.inc_errors("archive_list")
+                        return
                     try:
                         # 跳过目录
                         if member.isdir():
@@ -284,22 +324,17 @@ class TarArchiveScanner(ArchiveScanner):
                         except (ValueError, OSError):
                             modified = datetime.datetime.now()
 
-                        # 提前读取数据（注意：会占用内存，但必须在 tar_file 打开时读取）
+                        # 提前读取数据（注意：会占用内存，但必须在 tar_file 打开时读取，
+                        # 且此时正位于该成员的数据处，无需回退重新解压）
                         try:
                             extracted_file = tar_file.extractfile(member)
                             if extracted_file:
-                                data = extracted_file.read()
-
-                                def make_reader(file_data):
-                                    return lambda: file_data
-
-                                entry = ArchiveEntry(
+                                yield ArchiveEntry(
                                     name=member.name,
                                     size=member.size,
                                     modified=modified,
-                                    data_reader=make_reader(data),
+                                    data=extracted_file.read(),
                                 )
-                                yield entry
                             else:
                                 logger.warning(
                                     f"Cannot extract file {member.name} from TAR"
@@ -375,18 +410,12 @@ class RarArchiveScanner(ArchiveScanner):
 
                         # 提前读取数据（注意：会占用内存，但必须在 rar_file 打开时读取）
                         try:
-                            data = rar_file.read(info.filename)
-
-                            def make_reader(file_data):
-                                return lambda: file_data
-
-                            entry = ArchiveEntry(
+                            yield ArchiveEntry(
                                 name=info.filename,
                                 size=info.file_size,
                                 modified=modified,
-                                data_reader=make_reader(data),
+                                data=rar_file.read(info.filename),
                             )
-                            yield entry
                         except (
                             rarfile.BadRarFile,
                             rarfile.NeedFirstVolume,
@@ -448,18 +477,22 @@ def create_archive_scanner(
         return None
 
 
-def calculate_hash_from_data(data: bytes) -> dict[str, str]:
-    """从字节数据计算文件哈希"""
-    import hashlib
+def calculate_hash_from_data(data: Union[bytes, Iterable[bytes]]) -> dict[str, str]:
+    """从字节数据或按块产出的字节数据计算文件哈希"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return {
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha1": hashlib.sha1(data).hexdigest(),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
 
     md5 = hashlib.md5()
     sha1 = hashlib.sha1()
     sha256 = hashlib.sha256()
-
-    md5.update(data)
-    sha1.update(data)
-    sha256.update(data)
-
+    for chunk in data:
+        md5.update(chunk)
+        sha1.update(chunk)
+        sha256.update(chunk)
     return {
         "md5": md5.hexdigest(),
         "sha1": sha1.hexdigest(),
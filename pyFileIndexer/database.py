@@ -4,9 +4,10 @@ import time
 from typing import Any, Optional
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine, tuple_, text, func
+from sqlalchemy import create_engine, event, tuple_, text, func
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.exc import OperationalError
 
 from .base import Base
@@ -14,6 +15,13 @@ from .models import FileHash, FileMeta
 from .dto import FileHashDTO, FileMetaDTO, FileWithHashDTO
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """为每个新建的 SQLite 连接设置 PRAGMA（synchronous 只对当前连接生效）"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 def retry_on_db_lock(max_retries: int = 3, retry_delay: float = 0.5):
     """装饰器：在遇到数据库锁定时自动重试"""
 
@@ -70,6 +78,14 @@ class DatabaseManager:
             self.Session = None
             self._initialized = True
 
+    @classmethod
+    def create(cls) -> "DatabaseManager":
+        """创建独立于单例的数据库管理器，用于同时操作多个数据库（如测试隔离）"""
+        instance = super().__new__(cls)
+        instance._initialized = False
+        instance.__init__()
+        return instance
+
     def init(self, db_url: str):
         """初始化数据库连接，支持多线程安全。"""
         if db_url.startswith("sqlite"):
@@ -82,8 +98,11 @@ class DatabaseManager:
                 "echo": False,
             }
 
-            # 内存数据库不支持连接池参数
-            if db_url != "sqlite:///:memory:":
+            if db_url == "sqlite://" or ":memory:" in db_url or "mode=memory" in db_url:
+                # 内存数据库每个连接都是独立的库，默认的 SingletonThreadPool
+                # 会让每个线程看到一个空库；StaticPool 让所有线程共享同一连接
+                engine_kwargs["poolclass"] = StaticPool
+            else:
                 engine_kwargs.update(
                     {
                         "pool_size": 20,  # 连接池大小
@@ -94,6 +113,7 @@ class DatabaseManager:
                 )
 
             self.engine = create_engine(db_url, **engine_kwargs)
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
         else:
             # 其他数据库的标准配置
             self.engine = create_engine(
@@ -111,10 +131,10 @@ class DatabaseManager:
         Base.metadata.create_all(self.engine)
 
         # 启用 WAL 模式以支持并发读写 (仅 SQLite)
+        # journal_mode 写入数据库文件，设置一次即可；synchronous 由连接事件设置
         if db_url.startswith("sqlite"):
             with self.engine.connect() as conn:
                 conn.execute(text("PRAGMA journal_mode=WAL"))
-                conn.execute(text("PRAGMA synchronous=NORMAL"))
                 conn.commit()
                 logger = logging.getLogger(__name__)
                 logger.info("SQLite WAL mode enabled for better concurrency")
@@ -161,6 +181,15 @@ class DatabaseManager:
                         )
                     )
 
+                # 路径 + 扫描日期复合索引取代旧的单列路径索引
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_file_meta_path_scanned "
+                        "ON file_meta (path, scanned DESC)"
+                    )
+                )
+                conn.execute(text("DROP INDEX IF EXISTS ix_file_meta_path"))
+
         except Exception as e:
             # 忽略迁移错误，避免影响正常初始化
             logger = logging.getLogger(__name__)
@@ -206,7 +235,12 @@ class DatabaseManager:
     def get_file_by_path(self, path: str) -> Optional[FileMetaDTO]:
         """根据文件路径查询文件信息。"""
         with self.session_scope() as session:
-            result = session.query(FileMeta).filter_by(path=path).first()
+            result = (
+                session.query(FileMeta)
+                .filter_by(path=path)
+                .order_by(FileMeta.scanned.desc())
+                .first()
+            )
             if result:
                 return FileMetaDTO.from_orm(result)
             return None
@@ -219,6 +253,7 @@ class DatabaseManager:
                 session.query(FileMeta, FileHash)
                 .outerjoin(FileHash, FileMeta.hash_id == FileHash.id)
                 .filter(FileMeta.path == path)
+                .order_by(FileMeta.scanned.desc())
                 .first()
             )
 
@@ -240,13 +275,17 @@ class DatabaseManager:
                 session.query(FileMeta, FileHash)
                 .outerjoin(FileHash, FileMeta.hash_id == FileHash.id)
                 .filter(FileMeta.path.in_(paths))
+                .order_by(FileMeta.path, FileMeta.scanned.desc())
                 .all()
             )
 
+            # 同一路径有多条记录时保留最新一条，与 get_file_with_hash_by_path 一致
             result_dict = {}
             for file_meta, file_hash in results:
-                dto = FileWithHashDTO.from_orm(file_meta, file_hash)
-                result_dict[dto.meta.path] = dto
+                if file_meta.path not in result_dict:
+                    result_dict[file_meta.path] = FileWithHashDTO.from_orm(
+                        file_meta, file_hash
+                    )
 
             return result_dict
 
@@ -260,10 +299,20 @@ class DatabaseManager:
             return None
 
     @retry_on_db_lock(max_retries=5, retry_delay=0.5)
-    def get_hash_by_hash(self, hash: dict[str, str]) -> Optional[FileHashDTO]:
+    def get_hash_by_hash(
+        self, md5: str, sha1: str, sha256: str
+    ) -> Optional[FileHashDTO]:
         """根据哈希查询哈希信息。"""
         with self.session_scope() as session:
-            result = session.query(FileHash).filter_by(**hash).first()
+            result = (
+                session.query(FileHash)
+                .filter(
+                    FileHash.md5 == md5,
+                    FileHash.sha1 == sha1,
+                    FileHash.sha256 == sha256,
+                )
+                .first()
+            )
             if result:
                 return FileHashDTO.from_orm(result)
             return None
@@ -290,8 +339,11 @@ class DatabaseManager:
             if hash is not None:
                 # 如果哈希信息已经存在，则直接使用已有的哈希信息
                 # 在运行时，这些属性是实际值而不是Column对象
-                hash_dict = {"md5": hash.md5, "sha1": hash.sha1, "sha256": hash.sha256}  # type: ignore
-                if hash_in_db := self.get_hash_by_hash(hash_dict):  # type: ignore
+                if hash_in_db := self.get_hash_by_hash(
+                    hash.md5,  # type: ignore
+                    hash.sha1,  # type: ignore
+                    hash.sha256,  # type: ignore
+                ):
                     file.hash_id = hash_in_db.id  # type: ignore
                 else:
                     session.add(hash)
@@ -317,12 +369,11 @@ class DatabaseManager:
 
                 if hash is not None:
                     # 如果哈希信息已经存在，则直接使用已有的哈希信息
-                    hash_dict = {
-                        "md5": hash.md5,
-                        "sha1": hash.sha1,
-                        "sha256": hash.sha256,
-                    }  # type: ignore
-                    if hash_in_db := self.get_hash_by_hash(hash_dict):  # type: ignore
+                    if hash_in_db := self.get_hash_by_hash(
+                        hash.md5,  # type: ignore
+                        hash.sha1,  # type: ignore
+                        hash.sha256,  # type: ignore
+                    ):
                         existing_file.hash_id = hash_in_db.id  # type: ignore
                     else:
                         session.add(hash)
@@ -540,26 +591,29 @@ class DatabaseManager:
                 duplicate_hashes_query.offset(offset).limit(per_page).all()
             )
 
-            duplicates = []
-            total_files_count = 0
-
-            for md5_hash, hash_id, size, file_count in duplicate_hashes:
-                # 查找这个哈希对应的所有文件
+            # 一次查询取出本页所有重复组的文件，再按哈希分组
+            files_by_hash: dict[int, list[FileWithHashDTO]] = {
+                hash_id: [] for _, hash_id, _, _ in duplicate_hashes
+            }
+            if files_by_hash:
                 files = (
                     session.query(FileMeta, FileHash)
                     .join(FileHash, FileMeta.hash_id == FileHash.id)
-                    .filter(FileHash.id == hash_id)
+                    .filter(FileHash.id.in_(files_by_hash))
+                    .order_by(FileMeta.id)
                     .all()
                 )
+                for file_meta, file_hash in files:
+                    files_by_hash[file_hash.id].append(  # type: ignore
+                        FileWithHashDTO.from_orm(file_meta, file_hash)
+                    )
 
-                total_files_count += len(files)
-
-                # 转换为 DTO
-                file_dtos = [
-                    FileWithHashDTO.from_orm(file_meta, file_hash)
-                    for file_meta, file_hash in files
-                ]
+            duplicates = []
+            total_files_count = 0
 
+            for md5_hash, hash_id, size, file_count in duplicate_hashes:
+                file_dtos = files_by_hash[hash_id]
+                total_files_count += len(file_dtos)
                 duplicates.append({"hash": md5_hash, "files": file_dtos})
 
             return {
@@ -601,15 +655,17 @@ class DatabaseManager:
 
             return hash_mapping  # type: ignore
 
-    def add_files_batch(self, files_data: list[dict]):
+    def add_files_batch(self, files_data: list[dict]) -> int:
         """批量添加文件和哈希信息
         files_data: list of dict containing:
         - file_meta: FileMeta object
         - file_hash: FileHash object
         - operation: 'ADD' or 'MOD'
+
+        返回哈希在本批次之前已存在于数据库中的条目数
         """
         if not files_data:
-            return
+            return 0
 
         with self.session_scope() as session:
             # 1. 分离哈希和文件数据
@@ -651,6 +707,11 @@ class DatabaseManager:
 
             # 2. 批量查询已存在的哈希
             existing_hashes = self.get_existing_hashes_batch(hash_data)
+            reused_count = sum(
+                1
+                for item in hash_data
+                if (item["md5"], item["sha1"], item["sha256"]) in existing_hashes
+            )
 
             # 3. 准备需要插入的新哈希，去重批次内的重复哈希
             seen_hashes = set()
@@ -705,15 +766,23 @@ class DatabaseManager:
                 }
                 files_to_insert.append(file_dict)
 
-            # 处理更新文件
+            # 处理更新文件：一次查询取出所有待更新路径的现有记录
+            existing_files = {}
+            if update_files:
+                update_paths = [meta_dict["path"] for meta_dict, _ in update_files]
+                for existing_file in (
+                    session.query(FileMeta)
+                    .filter(FileMeta.path.in_(update_paths))
+                    .order_by(FileMeta.path, FileMeta.scanned.desc())
+                ):
+                    # 同一路径有多条记录时更新最新一条，与 get_file_by_path 一致
+                    existing_files.setdefault(existing_file.path, existing_file)
+
             for meta_dict, hash_dict in update_files:
                 hash_key = (hash_dict["md5"], hash_dict["sha1"], hash_dict["sha256"])
                 hash_id = existing_hashes[hash_key]
 
-                # 查找现有文件记录
-                existing_file = (
-                    session.query(FileMeta).filter_by(path=meta_dict["path"]).first()
-                )
+                existing_file = existing_files.get(meta_dict["path"])
                 if existing_file:
                     existing_file.name = meta_dict["name"]  # type: ignore
                     existing_file.created = meta_dict["created"]  # type: ignore
@@ -744,6 +813,8 @@ class DatabaseManager:
             if files_to_insert:
                 session.bulk_insert_mappings(FileMeta, files_to_insert)  # type: ignore
 
+        return reused_count
+
     def get_tree_data(self, path: str = "") -> dict:
         """获取树形结构数据
 
@@ -96,7 +96,7 @@ def _merge_single_database(
 
         # Process files in batches
         batch_size = 200
-        batch_data = []
+        pending = []
 
         with tqdm(
             total=total_files, desc=f"Merging {source_db_path.name}", unit="files"
@@ -110,74 +110,18 @@ def _merge_single_database(
 
             for file_meta, file_hash in files_query:
                 stats["total_files_processed"] += 1
+                pending.append((file_meta, file_hash))
 
-                # Check if file already exists in target database
-                dto = target_db_manager.get_file_with_hash_by_path(file_meta.path)
-
-                if dto:
-                    # Check if file data is identical
-                    if (
-                        dto.hash
-                        and file_hash
-                        and dto.hash.md5 == file_hash.md5
-                        and dto.hash.sha1 == file_hash.sha1
-                        and dto.hash.sha256 == file_hash.sha256
-                        and dto.meta.machine == file_meta.machine
-                    ):
-                        # File already exists with same data, skip
-                        stats["files_skipped"] += 1
-                        pbar.update(1)
-                        continue
-
-                # Create new FileMeta and FileHash objects for target database
-                new_file_meta = FileMeta(
-                    name=file_meta.name,
-                    path=file_meta.path,
-                    machine=file_meta.machine,
-                    created=file_meta.created,
-                    modified=file_meta.modified,
-                    scanned=file_meta.scanned,
-                    operation=file_meta.operation,
-                    is_archived=getattr(file_meta, "is_archived", 0),
-                    archive_path=getattr(file_meta, "archive_path", None),
-                )
-
-                if file_hash:
-                    new_file_hash = FileHash(
-                        md5=file_hash.md5,
-                        sha1=file_hash.sha1,
-                        sha256=file_hash.sha256,
-                        size=file_hash.size,
-                    )
-
-                    batch_data.append(
-                        {
-                            "file_meta": new_file_meta,
-                            "file_hash": new_file_hash,
-                            "operation": "ADD",
-                        }
-                    )
-                else:
-                    # File without hash (shouldn't happen normally, but handle it)
-                    logger.warning(f"File without hash: {file_meta.path}")
-                    batch_data.append(
-                        {
-                            "file_meta": new_file_meta,
-                            "file_hash": None,
-                            "operation": "ADD",
-                        }
-                    )
-
-                # Flush batch when it reaches batch_size
-                if len(batch_data) >= batch_size:
-                    _flush_batch(batch_data, target_db_manager, stats)
-                    batch_data.clear()
+                # Compare and flush once the batch reaches batch_size
+                if len(pending) >= batch_size:
+                    _merge_batch(pending, target_db_manager, stats)
+                    pending.clear()
 
                 pbar.update(1)
 
-            # Flush remaining data
-            if batch_data:
-                _flush_batch(batch_data, target_db_manager, stats)
+            # Merge remaining rows
+            if pending:
+                _merge_batch(pending, target_db_manager, stats)
 
     except Exception as e:
         logger.error(f"Error merging database {source_db_path}: {e}")
@@ -189,6 +133,85 @@ def _merge_single_database(
     return stats
 
 
+def _merge_batch(
+    pending: list, target_db_manager: DatabaseManager, stats: dict
+) -> None:
+    """
+    Compare a batch of source rows with the target database and flush new ones.
+
+    Existing target files are looked up with one query for the whole batch
+    instead of one query per source row.
+
+    Args:
+        pending: List of (FileMeta, FileHash or None) tuples from the source
+        target_db_manager: Target database manager
+        stats: Statistics dictionary to update
+    """
+    existing_files = target_db_manager.get_files_with_hash_by_paths_batch(
+        [file_meta.path for file_meta, _ in pending]
+    )
+
+    batch_data = []
+    for file_meta, file_hash in pending:
+        dto = existing_files.get(file_meta.path)
+
+        if dto:
+            # Check if file data is identical
+            if (
+                dto.hash
+                and file_hash
+                and dto.hash.md5 == file_hash.md5
+                and dto.hash.sha1 == file_hash.sha1
+                and dto.hash.sha256 == file_hash.sha256
+                and dto.meta.machine == file_meta.machine
+            ):
+                # File already exists with same data, skip
+                stats["files_skipped"] += 1
+                continue
+
+        # Create new FileMeta and FileHash objects for target database
+        new_file_meta = FileMeta(
+            name=file_meta.name,
+            path=file_meta.path,
+            machine=file_meta.machine,
+            created=file_meta.created,
+            modified=file_meta.modified,
+            scanned=file_meta.scanned,
+            operation=file_meta.operation,
+            is_archived=getattr(file_meta, "is_archived", 0),
+            archive_path=getattr(file_meta, "archive_path", None),
+        )
+
+        if file_hash:
+            new_file_hash = FileHash(
+                md5=file_hash.md5,
+                sha1=file_hash.sha1,
+                sha256=file_hash.sha256,
+                size=file_hash.size,
+            )
+
+            batch_data.append(
+                {
+                    "file_meta": new_file_meta,
+                    "file_hash": new_file_hash,
+                    "operation": "ADD",
+                }
+            )
+        else:
+            # File without hash (shouldn't happen normally, but handle it)
+            logger.warning(f"File without hash: {file_meta.path}")
+            batch_data.append(
+                {
+                    "file_meta": new_file_meta,
+                    "file_hash": None,
+                    "operation": "ADD",
+                }
+            )
+
+    if batch_data:
+        _flush_batch(batch_data, target_db_manager, stats)
+
+
 def _flush_batch(batch_data: list, target_db_manager: DatabaseManager, stats: dict):
     """
     Flush a batch of files to the target database.
@@ -199,35 +222,13 @@ def _flush_batch(batch_data: list, target_db_manager: DatabaseManager, stats: di
         stats: Statistics dictionary to update
     """
     try:
-        # Get existing hashes to determine reuse vs new
-        hash_data = []
-        for item in batch_data:
-            if item["file_hash"]:
-                hash_data.append(
-                    {
-                        "md5": item["file_hash"].md5,
-                        "sha1": item["file_hash"].sha1,
-                        "sha256": item["file_hash"].sha256,
-                    }
-                )
-
-        existing_hashes = target_db_manager.get_existing_hashes_batch(hash_data)
-
-        # Count new vs reused hashes
-        for item in batch_data:
-            if item["file_hash"]:
-                hash_key = (
-                    item["file_hash"].md5,
-                    item["file_hash"].sha1,
-                    item["file_hash"].sha256,
-                )
-                if hash_key in existing_hashes:
-                    stats["hashes_reused"] += 1
-                else:
-                    stats["hashes_added"] += 1
-
-        # Add files using batch operation
-        target_db_manager.add_files_batch(batch_data)
+        # add_files_batch reports how many rows reused a hash that already
+        # existed, so the existing hashes are only queried once per batch
+        hashes_reused = target_db_manager.add_files_batch(batch_data)
+        hashes_total = sum(1 for item in batch_data if item["file_hash"])
+
+        stats["hashes_reused"] += hashes_reused
+        stats["hashes_added"] += hashes_total - hashes_reused
         stats["files_added"] += len(batch_data)
 
     except Exception as e:
@@ -52,20 +52,26 @@ def init_file_logger(log_path: str):
     logger.addHandler(file_hander)
 
 
+def load_ignore_rules(ignore_file: str) -> tuple[set[str], set[str]]:
+    """读取忽略规则文件，返回 (按目录名忽略, 按路径片段忽略) 两组规则。"""
+    dirs: set[str] = set()
+    partials_dirs: set[str] = set()
+    if os.path.exists(ignore_file):
+        with open(ignore_file) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    if line.startswith("#"):
+                        continue
+                    if "/" in line:
+                        partials_dirs.add(line)
+                    else:
+                        dirs.add(line)
+    return dirs, partials_dirs
+
+
 ignore_file = ".ignore"
-ignore_dirs: set[str] = set()
-ignore_partials_dirs: set[str] = set()
-if os.path.exists(ignore_file):
-    with open(ignore_file) as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                if line.startswith("#"):
-                    continue
-                if "/" in line:
-                    ignore_partials_dirs.add(line)
-                else:
-                    ignore_dirs.add(line)
+ignore_dirs, ignore_partials_dirs = load_ignore_rules(ignore_file)
 
 
 def human_size(
@@ -78,18 +84,24 @@ def human_size(
 
 def get_hashes(file_path: Union[str, Path]) -> dict[str, str]:
     """Calculate MD5, SHA1, and SHA256 hashes of a file using hashlib with optimized I/O."""
-    md5 = hashlib.md5()
-    sha1 = hashlib.sha1()
-    sha256 = hashlib.sha256()
-
     # 优化：增大读取缓冲区从256KB到2MB，减少系统调用次数
     chunk_size = 1024 * 1024 * 2  # 2MB
 
-    with open(file_path, "rb", buffering=chunk_size) as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
+    # 每次读取的块已经足够大，不需要 BufferedReader 再分配一份缓冲区
+    with open(file_path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size < chunk_size:
+            # 小文件一次读完：按实际大小分配内存，而不是每个文件分配 2MB
+            data = f.read()
+            return {
+                "md5": hashlib.md5(data).hexdigest(),
+                "sha1": hashlib.sha1(data).hexdigest(),
+                "sha256": hashlib.sha256(data).hexdigest(),
+            }
+
+        md5 = hashlib.md5()
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        while chunk := f.read(chunk_size):
             # 单次循环更新所有哈希算法，提高效率
             md5.update(chunk)
             sha1.update(chunk)
@@ -214,22 +226,33 @@ def scan_file(file: Path):
         meta.operation = "ADD"  # type: ignore[attr-defined]
 
         # 检查文件是否已存在（优化：一次查询获取文件和哈希信息）
-        dto = db_manager.get_file_with_hash_by_path(file.absolute().as_posix())
-        if dto:
-            meta.operation = "MOD"  # type: ignore[attr-defined]
+        # 复用元数据中已计算的绝对路径，与入库时的路径格式一致
+        dto = db_manager.get_file_with_hash_by_path(meta.path)  # type: ignore[arg-type]
+        if (
+            dto
+            and dto.hash
+            and dto.hash.size == file_stat.st_size
+            and dto.meta.modified == meta.modified
+        ):
+            # 大小和修改时间都未变化，视为未修改，跳过读取和哈希计算
+            logger.debug(f"Skipping unchanged file: {file}")
+        else:
+            if dto:
+                meta.operation = "MOD"  # type: ignore[attr-defined]
 
-        # 获取文件哈希
-        hashes = get_hashes(file)
-        file_hash = FileHash(**hashes, size=file_stat.st_size)
+            # 获取文件哈希
+            hashes = get_hashes(file)
+            file_hash = FileHash(**hashes, size=file_stat.st_size)
 
-        # 添加到批量处理队列
-        batch_processor.add_file(meta, file_hash, meta.operation)
-        try:
-            metrics.inc_bytes(file_stat.st_size)
-        except Exception:
-            pass
+            # 添加到批量处理队列
+            batch_processor.add_file(meta, file_hash, meta.operation)
+            try:
+                metrics.inc_bytes(file_stat.st_size)
+            except Exception:
+                pass
 
         # 如果启用了压缩包扫描并且是压缩包文件，扫描内部文件
+        # 压缩包未修改时也会进入，内部条目各自跳过未修改的文件
         if cached_config.scan_archives and is_archive_file(file):
             scan_archive_file(file)
     except Exception as e:
@@ -340,6 +363,9 @@ def scan_archive_file(archive_path: Path):
             pass
         if getattr(cached_config, "archive_strict", False):
             raise
+    finally:
+        # 条目数据按需读取，所有批次处理完后才能关闭压缩包
+        scanner.close()
 
 
 def _process_archive_batch(
@@ -380,8 +406,7 @@ def _process_archive_batch(
 
             # 计算文件哈希
             try:
-                data = entry.read_data()
-                hashes = calculate_hash_from_data(data)
+                hashes = calculate_hash_from_data(entry.iter_chunks())
                 file_hash = FileHash(**hashes, size=entry.size)
 
                 # 添加到批量处理队列
@@ -512,8 +537,9 @@ def scan(path: Union[str, Path]):
         logger.error(f"Path not exists: {path}")
         metrics.set_scan_in_progress(0)
         return
-    if isinstance(path, str):
-        path = Path(path)
+    # 根目录先转为绝对路径，遍历得到的子路径都是绝对路径，
+    # 之后每个文件取绝对路径时不再需要 getcwd()
+    path = Path(path).absolute()
     # 更新扫描时间到缓存
     scan_time = datetime.datetime.now()
     cached_config.update_scanned_time(scan_time)
@@ -537,8 +563,8 @@ def scan(path: Union[str, Path]):
     refresh_stop_event = threading.Event()
 
     def _force_refresh():
-        while not refresh_stop_event.is_set() and not stop_event.is_set():
-            time.sleep(3)
+        # 用 Event.wait 代替 sleep：扫描结束时立即退出，不必等满一个刷新周期
+        while not refresh_stop_event.wait(3) and not stop_event.is_set():
             try:
                 pbar.refresh()
                 try:
@@ -622,8 +648,8 @@ def scan(path: Union[str, Path]):
         pass
 
 
-def main():
-    """pyFileIndexer 主入口函数"""
+def main(argv: list[str] | None = None):
+    """pyFileIndexer 主入口函数，argv 为 None 时解析 sys.argv"""
     parser = argparse.ArgumentParser(
         description="pyFileIndexer - A file indexing system for tracking files across storage locations"
     )
@@ -724,7 +750,7 @@ def main():
         default="indexer.log",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # 初始化数据库和日志
     db_manager.init("sqlite:///" + str(args.db_path))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from dataclasses import dataclass
 
 from .base import Base
@@ -28,8 +28,8 @@ class FileMeta(Base):
     name = Column(String, index=True)
     # 机器名称，添加索引用于按机器过滤
     machine = Column(String, index=True)
-    # 文件路径，全文索引
-    path = Column(String, index=True)
+    # 文件路径，与扫描日期组成复合索引（见 __table_args__）
+    path = Column(String)
     # 创建日期，添加索引用于时间范围查询
     created = Column(DateTime, index=True)
     # 修改日期，添加索引用于时间范围查询
@@ -42,3 +42,6 @@ class FileMeta(Base):
     is_archived = Column(Integer, index=True, default=0)
     # 压缩包路径，索引用于关联查询
     archive_path = Column(String, index=True)
+
+    # 按路径查找最新记录时可直接走索引，也覆盖只按路径的查询
+    __table_args__ = (Index("ix_file_meta_path_scanned", path, scanned.desc()),)
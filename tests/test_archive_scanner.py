@@ -1,11 +1,10 @@
 import datetime
 import io
-import os
-import tempfile
 import zipfile
 import tarfile
 from pathlib import Path
 
+import pytest
 
 from pyFileIndexer.archive_scanner import (
     is_archive_file,
@@ -17,6 +16,43 @@ from pyFileIndexer.archive_scanner import (
     calculate_hash_from_data,
 )
 
+# 固定时间，测试只比较相等性，不依赖当前时间
+FIXED_NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+# 模块内共享的压缩包内容
+SAMPLE_ZIP_FILES = {
+    "file1.txt": "Content of file 1",
+    "dir/file2.txt": "Content of file 2",
+    "file3.py": "print('Hello')",
+}
+SAMPLE_TAR_FILES = {
+    "file1.txt": "Content of file 1",
+    "dir/file2.txt": "Content of file 2",
+}
+
+
+@pytest.fixture(scope="module")
+def sample_zip(tmp_path_factory):
+    """模块内只创建一次的测试ZIP文件"""
+    zip_path = tmp_path_factory.mktemp("archives") / "sample.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for filename, data in SAMPLE_ZIP_FILES.items():
+            zip_file.writestr(filename, data)
+    return str(zip_path)
+
+
+@pytest.fixture(scope="module")
+def sample_tar(tmp_path_factory):
+    """模块内只创建一次的测试TAR文件"""
+    tar_path = tmp_path_factory.mktemp("archives") / "sample.tar"
+    with tarfile.open(tar_path, "w") as tar_file:
+        for filename, data in SAMPLE_TAR_FILES.items():
+            encoded = data.encode()
+            info = tarfile.TarInfo(name=filename)
+            info.size = len(encoded)
+            tar_file.addfile(info, io.BytesIO(encoded))
+    return str(tar_path)
+
 
 class TestArchiveDetection:
     """测试压缩包检测功能"""
@@ -53,7 +89,7 @@ class TestArchiveEntry:
 
     def test_archive_entry_creation(self):
         """测试创建压缩包条目"""
-        modified = datetime.datetime.now()
+        modified = FIXED_NOW
         entry = ArchiveEntry("test.txt", 100, modified)
 
         assert entry.name == "test.txt"
@@ -66,127 +102,115 @@ class TestArchiveEntry:
         test_data = b"Hello, World!"
         reader = lambda: test_data
 
-        entry = ArchiveEntry(
-            "test.txt", len(test_data), datetime.datetime.now(), data_reader=reader
-        )
+        entry = ArchiveEntry("test.txt", len(test_data), FIXED_NOW, data_reader=reader)
         assert entry.read_data() == test_data
 
+    def test_archive_entry_with_data(self):
+        """测试直接携带数据的压缩包条目"""
+        test_data = b"Hello, World!"
+        entry = ArchiveEntry("test.txt", len(test_data), FIXED_NOW, data=test_data)
+
+        assert entry.read_data() == test_data
+        assert b"".join(entry.iter_chunks()) == test_data
+
 
 class TestZipArchiveScanner:
     """测试ZIP压缩包扫描器"""
 
-    def create_test_zip(self, files_data):
+    def create_test_zip(self, tmp_path, files_data):
         """创建测试用的ZIP文件"""
-        temp_file = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
-        with zipfile.ZipFile(temp_file.name, "w") as zip_file:
+        zip_path = tmp_path / "test.zip"
+        with zipfile.ZipFile(zip_path, "w") as zip_file:
             for filename, data in files_data.items():
                 zip_file.writestr(filename, data)
-        return temp_file.name
+        return str(zip_path)
 
-    def test_zip_scanner_creation(self):
+    def test_zip_scanner_creation(self, sample_zip):
         """测试ZIP扫描器创建"""
-        zip_path = self.create_test_zip({"test.txt": "Hello"})
+        scanner = ZipArchiveScanner(sample_zip)
         try:
-            scanner = ZipArchiveScanner(zip_path)
-            assert scanner.archive_path == Path(zip_path)
+            assert scanner.archive_path == Path(sample_zip)
         finally:
-            os.unlink(zip_path)
+            scanner.close()
 
-    def test_zip_scan_entries(self):
+    def test_zip_scan_entries(self, sample_zip):
         """测试扫描ZIP文件条目"""
-        files_data = {
-            "file1.txt": "Content of file 1",
-            "dir/file2.txt": "Content of file 2",
-            "file3.py": "print('Hello')",
-        }
+        scanner = ZipArchiveScanner(sample_zip)
+        entries = []
+        file1_data = None
 
-        zip_path = self.create_test_zip(files_data)
+        # 注意：必须在 scanner 生命周期内读取数据（延迟读取模式）
         try:
-            scanner = ZipArchiveScanner(zip_path)
-            entries = []
-            file1_data = None
-
-            # 注意：必须在 scanner 生命周期内读取数据（延迟读取模式）
             for entry in scanner.scan_entries():
                 entries.append(entry)
                 # 在生成器迭代时立即读取数据
                 if entry.name == "file1.txt":
                     file1_data = entry.read_data()
-
-            assert len(entries) == 3
-            entry_names = [entry.name for entry in entries]
-            assert "file1.txt" in entry_names
-            assert "dir/file2.txt" in entry_names
-            assert "file3.py" in entry_names
-
-            # 验证读取的数据
-            assert file1_data is not None
-            assert file1_data.decode() == "Content of file 1"
-
         finally:
-            os.unlink(zip_path)
-
-    def test_zip_virtual_path(self):
+            # 扫描后压缩包保持打开，由调用方负责关闭
+            scanner.close()
+
+        assert len(entries) == 3
+        entry_names = [entry.name for entry in entries]
+        assert "file1.txt" in entry_names
+        assert "dir/file2.txt" in entry_names
+        assert "file3.py" in entry_names
+
+        # 验证读取的数据
+        assert file1_data is not None
+        assert file1_data.decode() == "Content of file 1"
+
+    def test_zip_entry_streaming(self, sample_zip):
+        """测试ZIP条目在 close() 之前可按块流式读取"""
+        scanner = ZipArchiveScanner(sample_zip)
+        entries = list(scanner.scan_entries())
+
+        # 扫描结束后压缩包仍保持打开，条目数据可按需读取
+        chunks = {entry.name: list(entry.iter_chunks(4)) for entry in entries}
+        assert b"".join(chunks["file1.txt"]) == b"Content of file 1"
+        assert all(len(chunk) <= 4 for chunk in chunks["file1.txt"])
+
+        scanner.close()
+        with pytest.raises(ValueError):
+            entries[0].read_data()
+
+    def test_zip_virtual_path(self, sample_zip):
         """测试虚拟路径创建"""
-        zip_path = self.create_test_zip({"test.txt": "Hello"})
-        try:
-            scanner = ZipArchiveScanner(zip_path)
-            virtual_path = scanner.create_virtual_path("test.txt")
-            expected = f"{Path(zip_path).as_posix()}::test.txt"
-            assert virtual_path == expected
-        finally:
-            os.unlink(zip_path)
+        scanner = ZipArchiveScanner(sample_zip)
+        virtual_path = scanner.create_virtual_path("test.txt")
+        expected = f"{Path(sample_zip).as_posix()}::test.txt"
+        assert virtual_path == expected
 
-    def test_zip_large_file_skip(self):
+    def test_zip_large_file_skip(self, tmp_path):
         """测试跳过过大文件"""
-        # 创建一个大的数据字符串（超过默认限制）
-        large_data = "x" * (200 * 1024 * 1024)  # 200MB
-        zip_path = self.create_test_zip({"large.txt": large_data, "small.txt": "small"})
+        # 降低大小限制，而不是生成超过默认 100MB 限制的数据
+        large_data = "x" * 1024
+        zip_path = self.create_test_zip(
+            tmp_path, {"large.txt": large_data, "small.txt": "small"}
+        )
 
+        scanner = ZipArchiveScanner(zip_path, max_file_size=512)
         try:
-            scanner = ZipArchiveScanner(zip_path)
-            entries = list(scanner.scan_entries())
-
-            # 应该只有小文件被扫描
-            assert len(entries) == 1
-            assert entries[0].name == "small.txt"
-
+            entry_names = [entry.name for entry in scanner.scan_entries()]
         finally:
-            os.unlink(zip_path)
+            scanner.close()
+
+        # 应该只有小文件被扫描
+        assert entry_names == ["small.txt"]
 
 
 class TestTarArchiveScanner:
     """测试TAR压缩包扫描器"""
 
-    def create_test_tar(self, files_data):
-        """创建测试用的TAR文件"""
-        temp_file = tempfile.NamedTemporaryFile(suffix=".tar", delete=False)
-        with tarfile.open(temp_file.name, "w") as tar_file:
-            for filename, data in files_data.items():
-                info = tarfile.TarInfo(name=filename)
-                info.size = len(data.encode())
-                tar_file.addfile(info, io.BytesIO(data.encode()))
-        return temp_file.name
-
-    def test_tar_scan_entries(self):
+    def test_tar_scan_entries(self, sample_tar):
         """测试扫描TAR文件条目"""
-        files_data = {
-            "file1.txt": "Content of file 1",
-            "dir/file2.txt": "Content of file 2",
-        }
+        scanner = TarArchiveScanner(sample_tar)
+        # 只保留条目名，不持有条目及其数据
+        entry_names = [entry.name for entry in scanner.scan_entries()]
 
-        tar_path = self.create_test_tar(files_data)
-        try:
-            scanner = TarArchiveScanner(tar_path)
-            entries = list(scanner.scan_entries())
-
-            assert len(entries) == 2
-            entry_names = [entry.name for entry in entries]
-            assert "file1.txt" in entry_names
-            assert "dir/file2.txt" in entry_names
-
-        finally:
-            os.unlink(tar_path)
+        assert len(entry_names) == 2
+        assert "file1.txt" in entry_names
+        assert "dir/file2.txt" in entry_names
 
 
 class TestArchiveScannerFactory:
@@ -235,6 +259,13 @@ class TestHashCalculation:
         assert hashes["md5"] == "d41d8cd98f00b204e9800998ecf8427e"
         assert hashes["sha1"] == "da39a3ee5e6b4b0d3255bfef95601890afd80709"
 
+    def test_chunked_data_hash(self):
+        """测试按块传入数据与一次性传入结果一致"""
+        test_data = b"Hello, World!" * 1000
+        chunks = (test_data[i : i + 4096] for i in range(0, len(test_data), 4096))
+
+        assert calculate_hash_from_data(chunks) == calculate_hash_from_data(test_data)
+
 
 class TestFileMetaCreation:
     """测试文件元数据创建"""
@@ -244,8 +275,9 @@ class TestFileMetaCreation:
         zip_path = "/test/archive.zip"
         scanner = ZipArchiveScanner(zip_path)
 
-        modified = datetime.datetime.now()
-        scanned = datetime.datetime.now()
+        modified = FIXED_NOW
+        # 与 modified 不同，才能区分字段是否写反
+        scanned = FIXED_NOW + datetime.timedelta(hours=1)
         entry = ArchiveEntry("test.txt", 100, modified)
 
         meta = scanner.create_file_meta(entry, "test-machine", scanned)
@@ -1,7 +1,9 @@
 import threading
-import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
+from sqlalchemy import text
 
 from pyFileIndexer.database import DatabaseManager
 from pyFileIndexer.models import FileHash, FileMeta
@@ -19,6 +21,14 @@ class TestDatabaseManager:
 
         assert db_manager1 is db_manager2
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_create_independent_manager(self, memory_db_manager):
+        """测试 create() 返回独立于单例的管理器"""
+        assert memory_db_manager is not DatabaseManager()
+        assert memory_db_manager is not DatabaseManager.create()
+        assert DatabaseManager.create().engine is None
+
     @pytest.mark.unit
     @pytest.mark.database
     def test_database_initialization(self, test_db_path):
@@ -30,6 +40,19 @@ class TestDatabaseManager:
         assert db_manager.Session is not None
         assert test_db_path.exists()
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_wal_mode_enabled(self, file_db_manager):
+        """测试文件数据库启用 WAL，且连接池中每个连接都使用 synchronous=NORMAL"""
+        # 同时检出两个连接，第二个必然是新建的连接
+        with file_db_manager.engine.connect() as conn1:
+            with file_db_manager.engine.connect() as conn2:
+                for conn in (conn1, conn2):
+                    journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+                    synchronous = conn.execute(text("PRAGMA synchronous")).scalar()
+                    assert journal_mode == "wal"
+                    assert synchronous == 1  # NORMAL
+
     @pytest.mark.unit
     @pytest.mark.database
     def test_memory_database_initialization(self):
@@ -52,10 +75,7 @@ class TestDatabaseManager:
     @pytest.mark.database
     def test_session_factory_without_init(self):
         """测试未初始化时调用会话工厂"""
-        db_manager = DatabaseManager()
-        # 重置初始化状态
-        db_manager.engine = None
-        db_manager.Session = None
+        db_manager = DatabaseManager.create()
 
         with pytest.raises(RuntimeError, match="Database is not initialized"):
             db_manager.session_factory()
@@ -144,6 +164,40 @@ class TestDatabaseManager:
         not_found = memory_db_manager.get_file_by_path("/nonexistent/path.txt")
         assert not_found is None
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_get_file_by_path_returns_latest_scan(self, memory_db_manager):
+        """测试同一路径有多条记录时返回最新扫描的一条，且查询走复合索引"""
+        path = "/unique/path/rescanned.txt"
+        for day in (1, 3, 2):
+            memory_db_manager.add_file(
+                FileMeta(
+                    name="rescanned.txt",
+                    path=path,
+                    machine="test_machine",
+                    scanned=datetime(2024, 1, day),
+                    operation="ADD",
+                )
+            )
+
+        assert memory_db_manager.get_file_by_path(path).scanned == datetime(2024, 1, 3)
+        dto = memory_db_manager.get_file_with_hash_by_path(path)
+        assert dto.meta.scanned == datetime(2024, 1, 3)
+        batch = memory_db_manager.get_files_with_hash_by_paths_batch([path])
+        assert batch[path].meta.scanned == datetime(2024, 1, 3)
+
+        with memory_db_manager.session_scope() as session:
+            plan = session.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT * FROM file_meta "
+                    "WHERE path = :path ORDER BY scanned DESC LIMIT 1"
+                ),
+                {"path": path},
+            ).all()
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_file_meta_path_scanned" in details
+        assert "TEMP B-TREE" not in details
+
     @pytest.mark.unit
     @pytest.mark.database
     def test_get_hash_by_id(self, memory_db_manager):
@@ -180,22 +234,18 @@ class TestDatabaseManager:
         memory_db_manager.add_hash(file_hash)
 
         # 查询测试
-        hash_dict = {
-            "md5": "unique_md5_hash",
-            "sha1": "unique_sha1_hash",
-            "sha256": "unique_sha256_hash",
-        }
-        retrieved_hash = memory_db_manager.get_hash_by_hash(hash_dict)
+        retrieved_hash = memory_db_manager.get_hash_by_hash(
+            md5="unique_md5_hash",
+            sha1="unique_sha1_hash",
+            sha256="unique_sha256_hash",
+        )
         assert retrieved_hash is not None
         assert retrieved_hash.md5 == "unique_md5_hash"
 
         # 查询不存在的哈希
-        nonexistent_hash = {
-            "md5": "nonexistent",
-            "sha1": "nonexistent",
-            "sha256": "nonexistent",
-        }
-        not_found = memory_db_manager.get_hash_by_hash(nonexistent_hash)
+        not_found = memory_db_manager.get_hash_by_hash(
+            "nonexistent", "nonexistent", "nonexistent"
+        )
         assert not_found is None
 
     @pytest.mark.unit
@@ -279,36 +329,110 @@ class TestDatabaseManager:
         assert retrieved_file is not None
         assert retrieved_file.hash_id == 1
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_add_files_batch_updates_modified_files(self, memory_db_manager):
+        """测试批量写入时 MOD 记录更新已有文件而不是新增"""
+
+        def make_batch(operation, content):
+            return [
+                {
+                    "file_meta": FileMeta(
+                        name=f"batch_{i}.txt",
+                        path=f"/test/batch_{i}.txt",
+                        machine="test_machine",
+                        operation=operation,
+                    ),
+                    "file_hash": FileHash(
+                        size=i,
+                        md5=f"{content}_md5_{i}",
+                        sha1=f"{content}_sha1_{i}",
+                        sha256=f"{content}_sha256_{i}",
+                    ),
+                    "operation": operation,
+                }
+                for i in range(3)
+            ]
+
+        memory_db_manager.add_files_batch(make_batch("ADD", "old"))
+        memory_db_manager.add_files_batch(make_batch("MOD", "new"))
+
+        files = memory_db_manager.get_files_with_hash_by_paths_batch(
+            [f"/test/batch_{i}.txt" for i in range(3)]
+        )
+        assert len(files) == 3
+        for i in range(3):
+            dto = files[f"/test/batch_{i}.txt"]
+            assert dto.meta.operation == "MOD"
+            assert dto.hash.md5 == f"new_md5_{i}"
+
+        with memory_db_manager.session_scope() as session:
+            assert session.query(FileMeta).count() == 3
+
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_find_duplicate_files_groups_files_by_hash(self, memory_db_manager):
+        """测试重复文件按哈希正确分组"""
+        batch = []
+        for group, count in (("a", 3), ("b", 2), ("c", 1)):
+            for i in range(count):
+                batch.append(
+                    {
+                        "file_meta": FileMeta(
+                            name=f"{group}_{i}.bin",
+                            path=f"/dup/{group}_{i}.bin",
+                            machine="test_machine",
+                            operation="ADD",
+                        ),
+                        "file_hash": FileHash(
+                            size=4096,
+                            md5=f"{group}_md5",
+                            sha1=f"{group}_sha1",
+                            sha256=f"{group}_sha256",
+                        ),
+                        "operation": "ADD",
+                    }
+                )
+        memory_db_manager.add_files_batch(batch)
+
+        result = memory_db_manager.find_duplicate_files(min_size=0)
+
+        assert result["total_groups"] == 2
+        assert result["total_files"] == 5
+        assert [group["hash"] for group in result["duplicates"]] == ["a_md5", "b_md5"]
+        assert [dto.meta.name for dto in result["duplicates"][0]["files"]] == [
+            "a_0.bin",
+            "a_1.bin",
+            "a_2.bin",
+        ]
+        assert [dto.meta.name for dto in result["duplicates"][1]["files"]] == [
+            "b_0.bin",
+            "b_1.bin",
+        ]
+
 
 class TestDatabaseConcurrency:
     """测试数据库并发操作"""
 
     @pytest.mark.unit
     @pytest.mark.database
+    @pytest.mark.parametrize("thread_count", [4, 16, 64])
     def test_concurrent_session_creation(self, memory_db_manager, thread_count):
         """测试并发创建会话"""
-        sessions = []
-        errors = []
 
-        def create_session():
-            try:
-                session = memory_db_manager.session_factory()
-                sessions.append(session)
-                time.sleep(0.1)  # 模拟一些工作
-                session.close()
-            except Exception as e:
-                errors.append(e)
+        # 所有线程都持有会话后才一起关闭，保证会话确实同时存在
+        barrier = threading.Barrier(thread_count)
 
-        threads = []
-        for _ in range(thread_count):
-            thread = threading.Thread(target=create_session)
-            threads.append(thread)
-            thread.start()
+        def create_session(_):
+            session = memory_db_manager.session_factory()
+            barrier.wait(timeout=10)
+            session.close()
+            return session
 
-        for thread in threads:
-            thread.join()
+        # 线程中的异常会在取回结果时重新抛出
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            sessions = list(executor.map(create_session, range(thread_count)))
 
-        assert len(errors) == 0
         assert len(sessions) == thread_count
 
     @pytest.mark.unit
@@ -342,6 +466,31 @@ class TestDatabaseConcurrency:
         # 验证获得了 session（可能相同也可能不同，取决于 scoped_session 的实现）
         assert len(thread_sessions) == 4
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    def test_memory_database_shared_across_threads(self, memory_db_manager):
+        """测试内存数据库在线程间共享同一个库"""
+        file_hash = FileHash(
+            size=512,
+            md5="shared_md5",
+            sha1="shared_sha1",
+            sha256="shared_sha256",
+        )
+        hash_id = memory_db_manager.add_hash(file_hash)
+
+        results = []
+
+        def read_hash():
+            results.append(memory_db_manager.get_hash_by_id(hash_id))
+
+        thread = threading.Thread(target=read_hash)
+        thread.start()
+        thread.join()
+
+        assert len(results) == 1
+        assert results[0] is not None
+        assert results[0].md5 == "shared_md5"
+
 
 class TestDatabaseErrors:
     """测试数据库错误处理"""
@@ -1,12 +1,17 @@
 """Tests for database merge functionality."""
 
 import datetime
-import os
-import tempfile
+import functools
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
 
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex, CreateTable
 
 from pyFileIndexer.base import Base
 from pyFileIndexer.database import DatabaseManager
@@ -15,25 +20,28 @@ from pyFileIndexer.models import FileHash, FileMeta
 
 
 @pytest.fixture
-def temp_db_files():
-    """Create temporary database files for testing."""
-    temp_files = []
-    for i in range(3):
-        temp_file = tempfile.NamedTemporaryFile(mode="w", suffix=".db", delete=False)
-        temp_file.close()
-        temp_files.append(temp_file.name)
-
-    yield temp_files
-
-    # Cleanup
-    for temp_file in temp_files:
-        try:
-            os.unlink(temp_file)
-        except:
-            pass
-
-
-def create_test_database(db_path: str, machine_name: str, num_files: int = 5):
+def temp_db_files(tmp_path):
+    """Return three database file paths in a per-test temporary directory."""
+    return [tmp_path / f"db{i}.db" for i in range(3)]
+
+
+@functools.cache
+def schema_ddl() -> str:
+    """Compile the CREATE statements for all tables and indexes once per session."""
+    dialect = sqlite.dialect()
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(
+            str(CreateTable(table, if_not_exists=True).compile(dialect=dialect))
+        )
+        statements.extend(
+            str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+            for index in table.indexes
+        )
+    return ";\n".join(statements) + ";"
+
+
+def create_test_database(db_path: Path, machine_name: str, num_files: int = 5):
     """
     Create a test database with sample data.
 
@@ -43,45 +51,71 @@ def create_test_database(db_path: str, machine_name: str, num_files: int = 5):
         num_files: Number of files to create
     """
     engine = create_engine(f"sqlite:///{db_path}")
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
 
     try:
-        timestamp = datetime.datetime.now()
+        # Run the precompiled schema instead of create_all() for every database
+        connection = engine.raw_connection()
+        try:
+            connection.driver_connection.executescript(schema_ddl())
+        finally:
+            connection.close()
 
-        for i in range(num_files):
-            # Create hash
-            file_hash = FileHash(
-                md5=f"md5_{machine_name}_{i}",
-                sha1=f"sha1_{machine_name}_{i}",
-                sha256=f"sha256_{machine_name}_{i}",
-                size=1024 * (i + 1),
+        timestamp = datetime.datetime.now()
+        hashes = [
+            {
+                "md5": f"md5_{machine_name}_{i}",
+                "sha1": f"sha1_{machine_name}_{i}",
+                "sha256": f"sha256_{machine_name}_{i}",
+                "size": 1024 * (i + 1),
+            }
+            for i in range(num_files)
+        ]
+
+        # Insert all rows with executemany in a single transaction
+        with engine.begin() as conn:
+            # RETURNING hands back the new ids in parameter order
+            hash_ids = (
+                conn.execute(
+                    insert(FileHash).returning(
+                        FileHash.id, sort_by_parameter_order=True
+                    ),
+                    hashes,
+                )
+                .scalars()
+                .all()
             )
-            session.add(file_hash)
-            session.flush()
-
-            # Create file metadata
-            file_meta = FileMeta(
-                hash_id=file_hash.id,
-                name=f"file_{i}.txt",
-                path=f"/test/{machine_name}/file_{i}.txt",
-                machine=machine_name,
-                created=timestamp,
-                modified=timestamp,
-                scanned=timestamp,
-                operation="ADD",
-                is_archived=0,
-                archive_path=None,
+            conn.execute(
+                insert(FileMeta),
+                [
+                    {
+                        "hash_id": hash_id,
+                        "name": f"file_{i}.txt",
+                        "path": f"/test/{machine_name}/file_{i}.txt",
+                        "machine": machine_name,
+                        "created": timestamp,
+                        "modified": timestamp,
+                        "scanned": timestamp,
+                        "operation": "ADD",
+                        "is_archived": 0,
+                        "archive_path": None,
+                    }
+                    for i, hash_id in enumerate(hash_ids)
+                ],
             )
-            session.add(file_meta)
-
-        session.commit()
     finally:
-        session.close()
         engine.dispose()
 
 
+def count_rows(session) -> tuple[int, int]:
+    """Return (file count, hash count) with a single SELECT."""
+    return session.execute(
+        select(
+            select(func.count(FileMeta.id)).scalar_subquery(),
+            select(func.count(FileHash.id)).scalar_subquery(),
+        )
+    ).one()
+
+
 def test_merge_two_databases(temp_db_files):
     """Test merging two databases with different files."""
     source_db1 = temp_db_files[0]
@@ -108,16 +142,17 @@ def test_merge_two_databases(temp_db_files):
 
     # Verify data in target database
     with target_manager.session_scope() as session:
-        file_count = session.query(FileMeta).count()
-        hash_count = session.query(FileHash).count()
-        assert file_count == 6
-        assert hash_count == 6
+        assert count_rows(session) == (6, 6)
 
         # Verify machines
-        machine1_files = session.query(FileMeta).filter_by(machine="machine1").count()
-        machine2_files = session.query(FileMeta).filter_by(machine="machine2").count()
-        assert machine1_files == 3
-        assert machine2_files == 3
+        machine_files = dict(
+            session.execute(
+                select(FileMeta.machine, func.count(FileMeta.id)).group_by(
+                    FileMeta.machine
+                )
+            ).all()
+        )
+        assert machine_files == {"machine1": 3, "machine2": 3}
 
 
 def test_merge_with_duplicate_hashes(temp_db_files):
@@ -204,10 +239,8 @@ def test_merge_with_duplicate_hashes(temp_db_files):
 
     # Verify data in target database
     with target_manager.session_scope() as session:
-        file_count = session.query(FileMeta).count()
-        hash_count = session.query(FileHash).count()
-        assert file_count == 2  # Two different files
-        assert hash_count == 1  # But same hash
+        # Two different files, but same hash
+        assert count_rows(session) == (2, 1)
 
 
 def test_merge_skip_existing_files(temp_db_files):
@@ -225,8 +258,7 @@ def test_merge_skip_existing_files(temp_db_files):
 
     # Get initial counts
     with target_manager.session_scope() as session:
-        initial_file_count = session.query(FileMeta).count()
-        initial_hash_count = session.query(FileHash).count()
+        initial_counts = count_rows(session)
 
     # Merge - should skip all files
     stats = merge_databases([source_db], target_manager)
@@ -238,10 +270,125 @@ def test_merge_skip_existing_files(temp_db_files):
 
     # Verify counts haven't changed
     with target_manager.session_scope() as session:
-        final_file_count = session.query(FileMeta).count()
-        final_hash_count = session.query(FileHash).count()
-        assert final_file_count == initial_file_count
-        assert final_hash_count == initial_hash_count
+        assert count_rows(session) == initial_counts
+
+
+def test_merge_looks_up_target_files_per_batch(temp_db_files, monkeypatch):
+    """Test that target files are looked up once per batch, not once per row."""
+    source_db = temp_db_files[0]
+    target_db = temp_db_files[1]
+
+    # 450 source files span three batches; the first 250 already exist
+    create_test_database(source_db, "machine1", num_files=450)
+
+    target_manager = DatabaseManager()
+    target_manager.init(f"sqlite:///{target_db}")
+    create_test_database(target_db, "machine1", num_files=250)
+
+    lookup_sizes = []
+    batch_lookup = target_manager.get_files_with_hash_by_paths_batch
+
+    def counting_batch_lookup(paths):
+        lookup_sizes.append(len(paths))
+        return batch_lookup(paths)
+
+    monkeypatch.setattr(
+        target_manager, "get_files_with_hash_by_paths_batch", counting_batch_lookup
+    )
+
+    stats = merge_databases([source_db], target_manager)
+
+    assert lookup_sizes == [200, 200, 50]
+    assert stats["total_files_processed"] == 450
+    assert stats["files_skipped"] == 250
+    assert stats["files_added"] == 200
+
+
+def test_merge_queries_existing_hashes_once_per_batch(temp_db_files, monkeypatch):
+    """Test that each flushed batch looks up existing hashes only once."""
+    source_db1 = temp_db_files[0]
+    source_db2 = temp_db_files[1]
+    target_db = temp_db_files[2]
+
+    create_test_database(source_db1, "machine1", num_files=3)
+    create_test_database(source_db2, "machine2", num_files=3)
+
+    target_manager = DatabaseManager()
+    target_manager.init(f"sqlite:///{target_db}")
+
+    hash_lookups = []
+    hash_lookup = target_manager.get_existing_hashes_batch
+
+    def counting_hash_lookup(hash_data):
+        hash_lookups.append(len(hash_data))
+        return hash_lookup(hash_data)
+
+    monkeypatch.setattr(
+        target_manager, "get_existing_hashes_batch", counting_hash_lookup
+    )
+
+    stats = merge_databases([source_db1, source_db2], target_manager)
+
+    # One batch per source database, one hash lookup per batch
+    assert hash_lookups == [3, 3]
+    assert stats["hashes_added"] == 6
+    assert stats["hashes_reused"] == 0
+
+
+@pytest.mark.slow
+@pytest.mark.large
+def test_merge_streams_source_rows(temp_db_files):
+    """Test that merging a large source keeps memory bounded by the batch size."""
+    source_db = temp_db_files[0]
+    target_db = temp_db_files[1]
+
+    num_files = 50_000
+    create_test_database(source_db, "machine1", num_files=num_files)
+
+    target_manager = DatabaseManager()
+    target_manager.init(f"sqlite:///{target_db}")
+
+    tracemalloc.start()
+    try:
+        stats = merge_databases([source_db], target_manager)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert stats["files_added"] == num_files
+    # Materializing 50k ORM row pairs would take well over 100 MB
+    assert peak < 50 * 1024 * 1024
+
+
+@pytest.mark.slow
+@pytest.mark.large
+def test_merge_scales_linearly(tmp_path):
+    """Test that merge time grows roughly linearly with the number of files."""
+    rounds = 3
+    timings = []
+    for num_files in (500, 5000):
+        source_db = tmp_path / f"source_{num_files}.db"
+        create_test_database(source_db, "machine1", num_files=num_files)
+
+        # Median of several rounds, each into a fresh target, to damp timer noise
+        samples = []
+        for round_no in range(rounds):
+            target_db = tmp_path / f"target_{num_files}_{round_no}.db"
+            target_manager = DatabaseManager.create()
+            target_manager.init(f"sqlite:///{target_db}")
+            try:
+                start = time.perf_counter()
+                stats = merge_databases([source_db], target_manager)
+                samples.append(time.perf_counter() - start)
+            finally:
+                target_manager.engine.dispose()
+
+            assert stats["files_added"] == num_files
+
+        timings.append(statistics.median(samples))
+
+    # Ten times the rows; a quadratic merge would take about 100 times as long
+    assert timings[1] / timings[0] < 20
 
 
 def test_merge_with_archived_files(temp_db_files):
@@ -343,5 +490,4 @@ def test_merge_empty_source_database(temp_db_files):
 
     # Verify target is still empty
     with target_manager.session_scope() as session:
-        file_count = session.query(FileMeta).count()
-        assert file_count == 0
+        assert count_rows(session) == (0, 0)
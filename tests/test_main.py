@@ -1,5 +1,6 @@
 import pytest
 import hashlib
+import os
 import threading
 import queue
 import time
@@ -15,6 +16,7 @@ from pyFileIndexer.main import (
     scan_file_worker,
     ignore_dirs,
     ignore_partials_dirs,
+    load_ignore_rules,
 )
 from pyFileIndexer.models import FileMeta
 
@@ -139,6 +141,20 @@ class TestHashCalculation:
         assert len(hashes["sha1"]) == 40
         assert len(hashes["sha256"]) == 64
 
+    @pytest.mark.unit
+    @pytest.mark.filesystem
+    def test_get_hashes_multi_chunk_file(self, temp_dir):
+        """测试超过一个读取块（2MB）的文件哈希计算"""
+        content = bytes(range(256)) * (5 * 4096)  # 5MB
+        multi_chunk_file = temp_dir / "multi_chunk.bin"
+        multi_chunk_file.write_bytes(content)
+
+        hashes = get_hashes(multi_chunk_file)
+
+        assert hashes["md5"] == hashlib.md5(content).hexdigest()
+        assert hashes["sha1"] == hashlib.sha1(content).hexdigest()
+        assert hashes["sha256"] == hashlib.sha256(content).hexdigest()
+
     @pytest.mark.unit
     @pytest.mark.filesystem
     def test_get_hashes_with_path_object(self, test_files):
@@ -273,12 +289,16 @@ class TestIgnoreRules:
     @pytest.mark.filesystem
     def test_ignore_file_parsing(self, create_ignore_file):
         """测试 .ignore 文件解析"""
-        # 由于 ignore 规则在模块导入时加载，我们需要重新加载模块来测试
-        # 或者测试解析逻辑的单独函数
+        dirs, partials_dirs = load_ignore_rules(str(create_ignore_file))
+
+        # 注释行被跳过，含 / 的规则按路径片段匹配
+        assert dirs == {"node_modules", ".git", "__pycache__", "*.log", "*.tmp"}
+        assert partials_dirs == {"/temp/", "/cache/"}
 
-        # 这里我们验证当前的 ignore 规则
-        # 在实际项目中可能需要重构代码以便更好地测试
-        pass
+    @pytest.mark.unit
+    def test_ignore_file_missing(self, temp_dir):
+        """测试 .ignore 文件不存在时没有忽略规则"""
+        assert load_ignore_rules(str(temp_dir / "missing.ignore")) == (set(), set())
 
 
 class TestFileScanningLogic:
@@ -321,22 +341,22 @@ class TestFileScanningLogic:
 
             batch_processor.flush()
 
-            file_meta = memory_db_manager.get_file_by_path(str(small_file.absolute()))
-            with patch("pyFileIndexer.main.get_metadata") as mock_get_metadata:
-                mock_get_metadata.return_value = file_meta
+            # 大小和修改时间都未变化，不应重新计算哈希或写入数据库
+            with patch("pyFileIndexer.main.get_hashes") as mock_get_hashes:
                 scan_file(small_file)
                 batch_processor.flush()
+            mock_get_hashes.assert_not_called()
 
             with memory_db_manager.session_factory() as session:
                 from pyFileIndexer.models import FileMeta
 
-                file = (
+                files = (
                     session.query(FileMeta)
                     .filter_by(path=str(small_file.absolute()))
-                    .first()
+                    .all()
                 )
-                assert file is not None
-                assert file.operation == "MOD"
+                assert len(files) == 1
+                assert files[0].operation == "ADD"
 
     @pytest.mark.unit
     @pytest.mark.database
@@ -380,6 +400,35 @@ class TestFileScanningLogic:
             latest_file = max(files, key=lambda f: f.scanned)
             assert latest_file.operation == "MOD"
 
+    @pytest.mark.unit
+    @pytest.mark.database
+    @pytest.mark.filesystem
+    def test_scan_file_same_size_new_mtime(
+        self, test_files, memory_db_manager, mock_settings
+    ):
+        """测试大小不变但修改时间变化的文件会重新计算哈希"""
+        small_file = test_files["small"]
+
+        with patch("pyFileIndexer.main.db_manager", memory_db_manager):
+            scan_file(small_file)
+            from pyFileIndexer.main import batch_processor
+
+            batch_processor.flush()
+
+            # 内容长度相同，只有修改时间能说明文件变了
+            small_file.write_text("Hello Earth")
+            stat = small_file.stat()
+            os.utime(small_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            scan_file(small_file)
+            batch_processor.flush()
+
+            dto = memory_db_manager.get_file_with_hash_by_path(
+                small_file.absolute().as_posix()
+            )
+            assert dto.meta.operation == "MOD"
+            assert dto.hash.md5 == hashlib.md5(b"Hello Earth").hexdigest()
+
     @pytest.mark.unit
     @pytest.mark.database
     @pytest.mark.filesystem